@@ -1,6 +1,30 @@
 import os
 
+import pytest
 from openai.version import VERSION as OPENAI_VERSION
 
 if OPENAI_VERSION.startswith("1"):
     os.environ["OPENAI_API_KEY"] = "mocked"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-slow",
+        action="store_true",
+        default=False,
+        help="Run tests marked as slow.",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: only run when --run-slow is given")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-slow"):
+        return
+
+    skip_slow = pytest.mark.skip(reason="Pass --run-slow to run")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+import guardrails as gd
+
+from .test_assets import entity_extraction
+from .test_assets.guards import guard_from_cached
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+CHASE_CARD_PDF = "docs/examples/data/chase_card_agreement.pdf"
+CHASE_CARD_CACHE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), ".cache", "chase_card.txt"
+)
+
+
+def _read_pdf_cached(path: str, cache_path: str) -> str:
+    """Read the pdf at the given path, reusing a text cache across sessions.
+
+    The cache is keyed on a SHA-256 of the pdf's path and mtime, stored
+    on the first line of the cache file.
+    """
+    key = hashlib.sha256(f"{path}:{os.path.getmtime(path)}".encode()).hexdigest()
+
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            cached_key, _, cached_content = f.read().partition("\n")
+        if cached_key == key:
+            return cached_content
+
+    content = gd.docs_utils.read_pdf(path)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Write to a per-process temp file first so that parallel test workers
+    # never observe a partially written cache.
+    tmp_path = f"{cache_path}.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"{key}\n{content}")
+    os.replace(tmp_path, cache_path)
+    return content
+
+
+@pytest.fixture
+def event_loop():
+    """Run async tests on uvloop when it is installed."""
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def chase_card_content():
+    return _read_pdf_cached(CHASE_CARD_PDF, CHASE_CARD_CACHE)[:6000]
+
+
+@pytest.fixture
+def reask_guard():
+    return guard_from_cached(entity_extraction.RAIL_SPEC_WITH_REASK)
+
+
+@pytest.fixture
+def pydantic_noop_guard():
+    return gd.Guard.from_pydantic(
+        entity_extraction.PYDANTIC_RAIL_WITH_NOOP, entity_extraction.PYDANTIC_PROMPT
+    )
@@ -0,0 +1,22 @@
+import functools
+import pickle
+
+import guardrails as gd
+from guardrails.rail import Rail
+
+
+@functools.lru_cache(maxsize=32)
+def pickled_rail(rail_string: str) -> bytes:
+    """Parse and compile a RAIL string once per process.
+
+    The compiled Rail is kept pickled; unpickling it is several times
+    faster than re-running `Rail.from_string` and yields an independent
+    copy, so nothing a test does to its schemas leaks into the cache.
+    """
+    return pickle.dumps(Rail.from_string(rail_string))
+
+
+def guard_from_cached(rail_string: str) -> gd.Guard:
+    # Guards record every call in `guard.history`, so each test gets its own
+    # instance rather than sharing one across the module.
+    return gd.Guard(rail=pickle.loads(pickled_rail(rail_string)))
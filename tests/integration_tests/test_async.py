@@ -1,3 +1,5 @@
+import asyncio
+import os
 from unittest.mock import patch
 
 import openai
@@ -13,242 +15,302 @@ from tests.integration_tests.test_assets.fixtures import (  # noqa
 )
 
 from .mock_llm_outputs import MockAsyncOpenAICallable, entity_extraction
-
-
-@pytest.mark.asyncio
-@pytest.mark.parametrize("multiprocessing_validators", (True, False))
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
-async def test_entity_extraction_with_reask(mocker, multiprocessing_validators: bool):
-    """Test that the entity extraction works with re-asking."""
-    mocker.patch(
+from .test_assets.guards import guard_from_cached
+
+pytestmark = [
+    pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0"),
+    pytest.mark.asyncio,
+]
+
+
+# (spec, validation_passed, validation_output, validated_output) for each
+# on-fail action applied to the entity extraction output.
+ON_FAIL_VARIANTS = [
+    pytest.param(
+        entity_extraction.RAIL_SPEC_WITH_NOOP,
+        False,
+        entity_extraction.VALIDATED_OUTPUT_NOOP,
+        None,
+        id="noop",
+    ),
+    pytest.param(
+        entity_extraction.RAIL_SPEC_WITH_FILTER,
+        True,
+        entity_extraction.VALIDATED_OUTPUT_FILTER,
+        entity_extraction.VALIDATED_OUTPUT_FILTER,
+        id="filter",
+    ),
+    pytest.param(
+        entity_extraction.RAIL_SPEC_WITH_FIX,
+        True,
+        entity_extraction.VALIDATED_OUTPUT_FIX,
+        entity_extraction.VALIDATED_OUTPUT_FIX,
+        id="fix",
+    ),
+    pytest.param(
+        entity_extraction.RAIL_SPEC_WITH_REFRAIN,
+        False,
+        {},
+        entity_extraction.VALIDATED_OUTPUT_REFRAIN,
+        id="refrain",
+    ),
+]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mock_async_openai():
+    with patch(
         "guardrails.llm_providers.AsyncOpenAICallable",
         new=MockAsyncOpenAICallable,
+    ):
+        yield
+
+
+@pytest.fixture(
+    params=(
+        # Spinning up the validator process pool dominates this module's runtime,
+        # so the multiprocessing variant only runs when explicitly requested.
+        pytest.param(
+            True,
+            marks=pytest.mark.skipif(
+                not os.environ.get("GUARDRAILS_TEST_MULTIPROCESSING"),
+                reason="GUARDRAILS_TEST_MULTIPROCESSING not set",
+            ),
+        ),
+        False,
     )
-    mocker.patch(
+)
+def multiprocessing_validators(request):
+    with patch(
         "guardrails.validators.Validator.run_in_separate_process",
-        new=multiprocessing_validators,
+        new=request.param,
+    ):
+        yield request.param
+
+
+async def test_entity_extraction_with_reask_basic(
+    multiprocessing_validators: bool, chase_card_content, reask_guard
+):
+    """Test that the entity extraction works with re-asking."""
+    guard = reask_guard
+    final_output = await guard(
+        llm_api=openai.Completion.acreate,
+        prompt_params={"document": chase_card_content},
+        num_reasks=1,
     )
 
-    content = gd.docs_utils.read_pdf("docs/examples/data/chase_card_agreement.pdf")
-    guard = gd.Guard.from_rail_string(entity_extraction.RAIL_SPEC_WITH_REASK)
+    call = guard.history.first
+    first = call.iterations.first
+    final = call.iterations.last
+
+    # Assertions are made on the guard state object.
+    actual = {
+        "validation_passed": final_output.validation_passed,
+        "validated_output": final_output.validated_output,
+        # The guard was only called once and re-asked once.
+        "calls": guard.history.length,
+        "iterations": call.iterations.length,
+        # For orginal prompt and output
+        "compiled_prompt": call.compiled_prompt,
+        "first_prompt": first.inputs.prompt.source,
+        "first_prompt_type": type(first.inputs.prompt),
+        "prompt_tokens_consumed": first.prompt_tokens_consumed,
+        "completion_tokens_consumed": first.completion_tokens_consumed,
+        "first_raw_output": first.raw_output,
+        "first_validation_output": first.validation_output,
+        # For re-asked prompt and output
+        "reask_prompt": call.reask_prompts.last,
+        "final_prompt": final.inputs.prompt.source,
+        "final_prompt_type": type(final.inputs.prompt),
+        "final_raw_output": final.raw_output,
+        "call_validated_output": call.validated_output,
+    }
+    expected = {
+        "validation_passed": True,
+        "validated_output": entity_extraction.VALIDATED_OUTPUT_REASK_2,
+        "calls": 1,
+        "iterations": 2,
+        "compiled_prompt": entity_extraction.COMPILED_PROMPT,
+        "first_prompt": entity_extraction.COMPILED_PROMPT,
+        "first_prompt_type": gd.Prompt,
+        "prompt_tokens_consumed": 123,
+        "completion_tokens_consumed": 1234,
+        "first_raw_output": entity_extraction.LLM_OUTPUT,
+        "first_validation_output": entity_extraction.VALIDATED_OUTPUT_REASK_1,
+        "reask_prompt": entity_extraction.COMPILED_PROMPT_REASK,
+        "final_prompt": entity_extraction.COMPILED_PROMPT_REASK,
+        "final_prompt_type": gd.Prompt,
+        "final_raw_output": entity_extraction.LLM_OUTPUT_REASK,
+        "call_validated_output": entity_extraction.VALIDATED_OUTPUT_REASK_2,
+    }
+    assert actual == expected
+
+
+async def test_entity_extraction_with_reask_spy(chase_card_content, reask_guard):
+    """Test that re-asking preprocesses the prompt through the output schema."""
+    guard = reask_guard
 
     with patch.object(
         JsonSchema, "preprocess_prompt", wraps=guard.output_schema.preprocess_prompt
     ) as mock_preprocess_prompt:
         final_output = await guard(
             llm_api=openai.Completion.acreate,
-            prompt_params={"document": content[:6000]},
+            prompt_params={"document": chase_card_content},
             num_reasks=1,
         )
 
         # Check that the preprocess_prompt method was called.
         mock_preprocess_prompt.assert_called()
 
-    # Assertions are made on the guard state object.
-    assert final_output.validation_passed is True
     assert final_output.validated_output == entity_extraction.VALIDATED_OUTPUT_REASK_2
 
-    guard_history = guard.history
-    call = guard_history.first
-
-    # Check that the guard was only called once and
-    # has the correct number of re-asks.
-    assert guard_history.length == 1
-    assert call.iterations.length == 2
-
-    # For orginal prompt and output
-    first = call.iterations.first
-    assert first.inputs.prompt == gd.Prompt(entity_extraction.COMPILED_PROMPT)
-    # Same as above
-    assert call.compiled_prompt == entity_extraction.COMPILED_PROMPT
-    assert first.prompt_tokens_consumed == 123
-    assert first.completion_tokens_consumed == 1234
-    assert first.raw_output == entity_extraction.LLM_OUTPUT
-    assert first.validation_output == entity_extraction.VALIDATED_OUTPUT_REASK_1
-
-    # For re-asked prompt and output
-    final = call.iterations.last
-    assert final.inputs.prompt == gd.Prompt(entity_extraction.COMPILED_PROMPT_REASK)
-    # Same as above
-    assert call.reask_prompts.last == entity_extraction.COMPILED_PROMPT_REASK
-    assert final.raw_output == entity_extraction.LLM_OUTPUT_REASK
-    assert call.validated_output == entity_extraction.VALIDATED_OUTPUT_REASK_2
-
-
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
-async def test_entity_extraction_with_noop(mocker):
-    mocker.patch(
-        "guardrails.llm_providers.AsyncOpenAICallable",
-        new=MockAsyncOpenAICallable,
-    )
-    content = gd.docs_utils.read_pdf("docs/examples/data/chase_card_agreement.pdf")
-    guard = gd.Guard.from_rail_string(entity_extraction.RAIL_SPEC_WITH_NOOP)
-    final_output = await guard(
-        llm_api=openai.Completion.acreate,
-        prompt_params={"document": content[:6000]},
-        num_reasks=1,
-    )
-
-    # Assertions are made on the guard state object.
 
-    # Old assertion which is wrong
-    # This should not pass validation and therefore will not have a validated output
-    # assert final_output.validated_output == entity_extraction.VALIDATED_OUTPUT_NOOP
-
-    assert final_output.validation_passed is False
-    assert final_output.validated_output is None
-
-    call = guard.history.first
-
-    # Check that the guard was called once
-    # and did not have to reask
-    assert guard.history.length == 1
-    assert call.iterations.length == 1
-
-    # For orginal prompt and output
-    assert call.compiled_prompt == entity_extraction.COMPILED_PROMPT
-    assert call.raw_outputs.last == entity_extraction.LLM_OUTPUT
-    assert call.validation_output == entity_extraction.VALIDATED_OUTPUT_NOOP
-
-
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
-async def test_entity_extraction_with_noop_pydantic(mocker):
-    mocker.patch(
-        "guardrails.llm_providers.AsyncOpenAICallable",
-        new=MockAsyncOpenAICallable,
-    )
-    content = gd.docs_utils.read_pdf("docs/examples/data/chase_card_agreement.pdf")
-    guard = gd.Guard.from_pydantic(
-        entity_extraction.PYDANTIC_RAIL_WITH_NOOP, entity_extraction.PYDANTIC_PROMPT
-    )
-    final_output = await guard(
-        llm_api=openai.Completion.acreate,
-        prompt_params={"document": content[:6000]},
-        num_reasks=1,
-    )
-
-    # Assertions are made on the guard state object.
-    assert final_output.validation_passed is False
-    assert final_output.validated_output is None
-
-    call = guard.history.first
-
-    # Check that the guard was called once
-    # and did not have toreask
-    assert guard.history.length == 1
-    assert call.iterations.length == 1
-
-    # For orginal prompt and output
-    assert call.compiled_prompt == entity_extraction.COMPILED_PROMPT
-    assert call.raw_outputs.last == entity_extraction.LLM_OUTPUT
-    assert call.validation_output == entity_extraction.VALIDATED_OUTPUT_NOOP
-
-
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
-async def test_entity_extraction_with_filter(mocker):
-    """Test that the entity extraction works with re-asking."""
-    mocker.patch(
-        "guardrails.llm_providers.AsyncOpenAICallable",
-        new=MockAsyncOpenAICallable,
-    )
-
-    content = gd.docs_utils.read_pdf("docs/examples/data/chase_card_agreement.pdf")
-    guard = gd.Guard.from_rail_string(entity_extraction.RAIL_SPEC_WITH_FILTER)
+@pytest.mark.slow
+@pytest.mark.parametrize(
+    "spec,passed,validation_output,validated_output", ON_FAIL_VARIANTS
+)
+async def test_entity_extraction_variant(
+    chase_card_content, spec, passed, validation_output, validated_output
+):
+    """Test that the entity extraction works with each on-fail action."""
+    guard = guard_from_cached(spec)
     final_output = await guard(
         llm_api=openai.Completion.acreate,
-        prompt_params={"document": content[:6000]},
+        prompt_params={"document": chase_card_content},
         num_reasks=1,
     )
 
-    # Assertions are made on the guard state object.
-    assert final_output.validation_passed is True
-    assert final_output.validated_output == entity_extraction.VALIDATED_OUTPUT_FILTER
-
     call = guard.history.first
 
-    # Check that the guard state object has the correct number of re-asks.
-    assert guard.history.length == 1
-    assert call.iterations.length == 1
-
-    # For orginal prompt and output
-    assert call.compiled_prompt == entity_extraction.COMPILED_PROMPT
-    assert call.raw_outputs.last == entity_extraction.LLM_OUTPUT
-    assert call.validation_output == entity_extraction.VALIDATED_OUTPUT_FILTER
-    assert call.validated_output == entity_extraction.VALIDATED_OUTPUT_FILTER
-
-
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
-async def test_entity_extraction_with_fix(mocker):
-    """Test that the entity extraction works with re-asking."""
-    mocker.patch(
-        "guardrails.llm_providers.AsyncOpenAICallable",
-        new=MockAsyncOpenAICallable,
+    # Assertions are made on the guard state object. The guard was called once
+    # and did not have to reask.
+    actual = {
+        "validation_passed": final_output.validation_passed,
+        "validated_output": final_output.validated_output,
+        "calls": guard.history.length,
+        "iterations": call.iterations.length,
+        "compiled_prompt": call.compiled_prompt,
+        "raw_output": call.raw_outputs.last,
+        "validation_output": call.validation_output,
+        "call_validated_output": call.validated_output,
+    }
+    expected = {
+        "validation_passed": passed,
+        "validated_output": validated_output,
+        "calls": 1,
+        "iterations": 1,
+        "compiled_prompt": entity_extraction.COMPILED_PROMPT,
+        "raw_output": entity_extraction.LLM_OUTPUT,
+        "validation_output": validation_output,
+        "call_validated_output": validated_output,
+    }
+    assert actual == expected
+
+
+async def test_entity_extraction_all_variants(chase_card_content):
+    """Test that the re-ask and on-fail guards can run concurrently."""
+    reask_guard = guard_from_cached(entity_extraction.RAIL_SPEC_WITH_REASK)
+    on_fail_guards = [guard_from_cached(v.values[0]) for v in ON_FAIL_VARIANTS]
+    results = await asyncio.gather(
+        *(
+            guard(
+                llm_api=openai.Completion.acreate,
+                prompt_params={"document": chase_card_content},
+                num_reasks=1,
+            )
+            for guard in [reask_guard, *on_fail_guards]
+        )
     )
-
-    content = gd.docs_utils.read_pdf("docs/examples/data/chase_card_agreement.pdf")
-    guard = gd.Guard.from_rail_string(entity_extraction.RAIL_SPEC_WITH_FIX)
-    final_output = await guard(
-        llm_api=openai.Completion.acreate,
-        prompt_params={"document": content[:6000]},
-        num_reasks=1,
+    reask_output, *on_fail_outputs = results
+
+    # The re-asked call merges its iterations, so check each iteration's output.
+    call = reask_guard.history.first
+    actual = (
+        reask_output.validation_passed,
+        reask_output.validated_output,
+        reask_guard.history.length,
+        call.iterations.length,
+        call.compiled_prompt,
+        call.raw_outputs.first,
+        call.iterations.first.validation_output,
+        call.validated_output,
     )
-
-    # Assertions are made on the guard state object.
-    assert final_output.validation_passed is True
-    assert final_output.validated_output == entity_extraction.VALIDATED_OUTPUT_FIX
-
-    call = guard.history.first
-
-    # Check that the guard state object has the correct number of re-asks.
-    assert guard.history.length == 1
-
-    # For orginal prompt and output
-    assert call.compiled_prompt == entity_extraction.COMPILED_PROMPT
-    assert call.raw_outputs.last == entity_extraction.LLM_OUTPUT
-    assert call.validated_output == entity_extraction.VALIDATED_OUTPUT_FIX
-
-
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
-async def test_entity_extraction_with_refrain(mocker):
-    """Test that the entity extraction works with re-asking."""
-    mocker.patch(
-        "guardrails.llm_providers.AsyncOpenAICallable",
-        new=MockAsyncOpenAICallable,
+    assert actual == (
+        True,
+        entity_extraction.VALIDATED_OUTPUT_REASK_2,
+        1,
+        2,
+        entity_extraction.COMPILED_PROMPT,
+        entity_extraction.LLM_OUTPUT,
+        entity_extraction.VALIDATED_OUTPUT_REASK_1,
+        entity_extraction.VALIDATED_OUTPUT_REASK_2,
     )
 
-    content = gd.docs_utils.read_pdf("docs/examples/data/chase_card_agreement.pdf")
-    guard = gd.Guard.from_rail_string(entity_extraction.RAIL_SPEC_WITH_REFRAIN)
+    for guard, final_output, variant in zip(
+        on_fail_guards, on_fail_outputs, ON_FAIL_VARIANTS
+    ):
+        _, passed, validation_output, validated_output = variant.values
+        call = guard.history.first
+        actual = (
+            final_output.validation_passed,
+            final_output.validated_output,
+            guard.history.length,
+            call.iterations.length,
+            call.compiled_prompt,
+            call.raw_outputs.first,
+            call.validation_output,
+            call.validated_output,
+        )
+        assert actual == (
+            passed,
+            validated_output,
+            1,
+            1,
+            entity_extraction.COMPILED_PROMPT,
+            entity_extraction.LLM_OUTPUT,
+            validation_output,
+            validated_output,
+        ), variant.id
+
+
+async def test_entity_extraction_with_noop_pydantic(
+    chase_card_content, pydantic_noop_guard
+):
+    guard = pydantic_noop_guard
     final_output = await guard(
         llm_api=openai.Completion.acreate,
-        prompt_params={"document": content[:6000]},
+        prompt_params={"document": chase_card_content},
         num_reasks=1,
     )
-    # Assertions are made on the guard state object.
-
-    assert final_output.validation_passed is False
-    assert final_output.validated_output == entity_extraction.VALIDATED_OUTPUT_REFRAIN
 
     call = guard.history.first
 
-    # Check that the guard state object has the correct number of re-asks.
-    assert guard.history.length == 1
-
-    # For orginal prompt and output
-    assert call.compiled_prompt == entity_extraction.COMPILED_PROMPT
-    assert call.raw_outputs.last == entity_extraction.LLM_OUTPUT
-    assert call.validated_output == entity_extraction.VALIDATED_OUTPUT_REFRAIN
+    # Assertions are made on the guard state object. The guard was called once
+    # and did not have to reask.
+    actual = {
+        "validation_passed": final_output.validation_passed,
+        "validated_output": final_output.validated_output,
+        "calls": guard.history.length,
+        "iterations": call.iterations.length,
+        "compiled_prompt": call.compiled_prompt,
+        "raw_output": call.raw_outputs.last,
+        "validation_output": call.validation_output,
+    }
+    expected = {
+        "validation_passed": False,
+        "validated_output": None,
+        "calls": 1,
+        "iterations": 1,
+        "compiled_prompt": entity_extraction.COMPILED_PROMPT,
+        "raw_output": entity_extraction.LLM_OUTPUT,
+        "validation_output": entity_extraction.VALIDATED_OUTPUT_NOOP,
+    }
+    assert actual == expected
 
 
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
 async def test_rail_spec_output_parse(rail_spec, llm_output, validated_output):
     """Test that the rail_spec fixture is working."""
-    guard = gd.Guard.from_rail_string(rail_spec)
+    guard = guard_from_cached(rail_spec)
     output = await guard.parse(
         llm_output,
         llm_api=openai.Completion.acreate,
@@ -282,13 +344,11 @@ def validated_string_output():
     return "string output"
 
 
-@pytest.mark.asyncio
-@pytest.mark.skipif(not OPENAI_VERSION.startswith("0"), reason="Only for OpenAI v0")
 async def test_string_rail_spec_output_parse(
     string_rail_spec, string_llm_output, validated_string_output
 ):
     """Test that the string_rail_spec fixture is working."""
-    guard = gd.Guard.from_rail_string(string_rail_spec)
+    guard = guard_from_cached(string_rail_spec)
     output = await guard.parse(
         string_llm_output,
         llm_api=openai.Completion.acreate,